@@ -6,54 +6,66 @@
 
 import os
 import sys
+import atexit
+import codecs
 import argparse
 import logging
 import re
+import shlex
+import pickle
+import itertools
+import selectors
 import subprocess
 import threading
 import tempfile
 import paramiko
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
 from typing import List, Dict, Tuple, Optional
 from datetime import datetime
 
+# Optional libssh2-backed client (parallel-ssh): crypto and framing run in C
+# and all hosts share one event loop. Used when installed, paramiko otherwise.
+try:
+    from pssh.clients import ParallelSSHClient
+except ImportError:
+    ParallelSSHClient = None
+
 # Constants
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 SCRIPT_NAME = os.path.basename(__file__)
 SSH_CONFIG_FILE = os.path.expanduser("~/.ssh/config")
+CACHE_DIR = os.path.expanduser("~/.cache/xssh")
+CONFIG_CACHE_FILE = os.path.join(CACHE_DIR, "config.pickle")
 
-# Global Variables
-LOG_FILE = ""
-DEBUG_MODE = False
-VERBOSE_MODE = False
-MASS_MODE = False
-SUDO_MODE = False
-USERNAME = ""
-PATTERN = ""
-HOSTS = []
-SSH_OPTIONS = []
-COMMAND = []
+# Execution Context
+# Frozen so it can be pickled unchanged into worker processes; carries all
+# per-run state instead of module globals, so every access is a plain
+# attribute load and nothing is mutated behind a caller's back.
+@dataclass(frozen=True)
+class SSHContext:
+    pattern: str
+    username: str
+    command: Tuple[str, ...]
+    ssh_options: Tuple[str, ...]
+    mass_mode: bool
+    sudo_mode: bool
+    verbose_mode: bool
+    debug_mode: bool
+    log_file: str
+    jobs: int = 64
+    hosts: Tuple[str, ...] = ()
 
 # Logging Setup
-def setup_logging():
-    log_level = logging.DEBUG if DEBUG_MODE else logging.INFO
+def setup_logging(debug_mode: bool, log_file: str):
+    log_level = logging.DEBUG if debug_mode else logging.INFO
     logging.basicConfig(level=log_level, format="%(asctime)s - [%(levelname)s] - %(message)s")
-    if LOG_FILE:
-        handler = logging.FileHandler(LOG_FILE)
+    if log_file:
+        handler = logging.FileHandler(log_file)
         handler.setFormatter(logging.Formatter("%(asctime)s - [%(levelname)s] - %(message)s"))
         logging.getLogger().addHandler(handler)
 
-def log(level: str, message: str):
-    if level == "DEBUG" and not DEBUG_MODE:
-        return
-    if level == "ERROR":
-        logging.error(message)
-    elif level == "DEBUG":
-        logging.debug(message)
-    else:
-        logging.info(message)
-
-def log_debug(action: str, host: str):
-    log("DEBUG", f"{action} on {host}")
+logger = logging.getLogger("xssh")
 
 # Usage Information
 def usage():
@@ -71,6 +83,7 @@ Options:
   -l file     Specify log file (optional).
   --mass      Enable mass mode for executing commands on multiple hosts.
   --sudo      Execute commands with sudo on remote hosts (requires tty).
+  --jobs N    Maximum parallel SSH sessions in mass mode (default: 64).
 
 Restricted Commands (mass mode only):
   shutdown, poweroff, reboot
@@ -95,228 +108,425 @@ def parse_arguments() -> Tuple[List[str], List[str]]:
     parser.add_argument("-l", type=str, dest="log_file", help="Specify log file (optional).")
     parser.add_argument("--mass", action="store_true", dest="mass", help="Enable mass mode for multiple hosts.")
     parser.add_argument("--sudo", action="store_true", dest="sudo", help="Execute commands with sudo on remote hosts.")
+    parser.add_argument("--jobs", type=int, dest="jobs", default=64, help="Maximum parallel SSH sessions in mass mode.")
     parser.add_argument("pattern", type=str, help="Pattern or host to connect to.")
     parser.add_argument("command", nargs="*", help="Command to execute on remote hosts.")
     return parser.parse_args()
 
-def validate_input(args):
-    global MASS_MODE, SUDO_MODE, DEBUG_MODE, VERBOSE_MODE, LOG_FILE, PATTERN, COMMAND, SSH_OPTIONS
-    MASS_MODE = args.mass
-    SUDO_MODE = args.sudo
-    DEBUG_MODE = args.debug
-    VERBOSE_MODE = args.verbose
-    LOG_FILE = args.log_file if args.log_file else ""
-    PATTERN = args.pattern
-    COMMAND = args.command
-    SSH_OPTIONS = []
+def validate_input(args) -> SSHContext:
+    ssh_options = []
     if args.x11:
-        SSH_OPTIONS.append("-X")
+        ssh_options.append("-X")
     if args.port:
-        SSH_OPTIONS.extend(["-p", args.port])
+        ssh_options.extend(["-p", args.port])
     if args.local_forward:
-        SSH_OPTIONS.extend(["-L", args.local_forward])
+        ssh_options.extend(["-L", args.local_forward])
     if args.dynamic_forward:
-        SSH_OPTIONS.extend(["-D", args.dynamic_forward])
-    if MASS_MODE and not COMMAND:
-        log("ERROR", "--mass requires a command to be provided.")
+        ssh_options.extend(["-D", args.dynamic_forward])
+    if args.mass and not args.command:
+        logger.error("--mass requires a command to be provided.")
+        sys.exit(1)
+    if args.mass and args.command:
+        validate_command(args.command)
+    return SSHContext(
+        pattern=args.pattern,
+        username="",
+        command=tuple(args.command),
+        ssh_options=tuple(ssh_options),
+        mass_mode=args.mass,
+        sudo_mode=args.sudo,
+        verbose_mode=args.verbose,
+        debug_mode=args.debug,
+        log_file=args.log_file if args.log_file else "",
+        jobs=max(1, args.jobs),
+    )
+
+# Mass-mode denylist, compiled once at import. Searched over the raw command
+# string so keywords smuggled past tokenization ('reboot;true', '$(reboot)')
+# are still caught; the lookarounds keep /sbin/shutdown-monitor from being a
+# false positive.
+_FORBIDDEN_RE = re.compile(r"(?<![\w/-])(shutdown|poweroff|reboot)(?![\w-])")
+
+def validate_command(command: List[str]):
+    cmd_str = " ".join(command)
+    match = _FORBIDDEN_RE.search(cmd_str)
+    if match:
+        logger.error("The command '%s' is not allowed in mass mode.", match.group(1))
         sys.exit(1)
-    if MASS_MODE and COMMAND:
-        validate_command()
-
-def validate_command():
-    forbidden_commands = ["shutdown", "poweroff", "reboot"]
-    cmd_str = " ".join(COMMAND)
-    for cmd in forbidden_commands:
-        if cmd in cmd_str:
-            log("ERROR", f"The command '{cmd}' is not allowed in mass mode.")
-            sys.exit(1)
-
-def validate_prerequisites():
-    if not os.path.isfile(SSH_CONFIG_FILE):
-        log("WARN", "SSH config file not found. Proceeding without it.")
-    log("DEBUG", "Prerequisites validated.")
 
 # Host Extraction
-def extract_hosts():
-    global HOSTS, USERNAME
-    host_pattern = PATTERN
+def parse_ssh_config() -> Tuple[List[Tuple[str, str]], Dict[str, str]]:
+    """Parse SSH_CONFIG_FILE into a pre-sorted (casefolded, host) list and a Host -> Hostname map."""
+    hosts_set = set()
+    hostnames = {}
+    current_host = ""
+    with open(SSH_CONFIG_FILE, "r") as f:
+        for raw_line in f:
+            line = raw_line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                parts = shlex.split(line)
+            except ValueError:
+                continue
+            if not parts:
+                continue
+            if parts[0] == "Host":
+                for h in parts[1:]:
+                    if "*" not in h:
+                        current_host = h
+                        hosts_set.add(h)
+            elif parts[0] == "Hostname" and len(parts) > 1:
+                if current_host:
+                    hostnames[current_host] = parts[1]
+    # Decorate-sort-undecorate: split each host once, compare the small
+    # label tuples directly, then strip the decoration.
+    decorated = [(h.split("."), h.casefold(), h) for h in hosts_set]
+    decorated.sort()
+    sorted_hosts = [(h_cf, h) for _, h_cf, h in decorated]
+    return sorted_hosts, hostnames
+
+def load_ssh_config() -> Optional[Tuple[List[Tuple[str, str]], Dict[str, str]]]:
+    """Return the parsed config, cached on disk and invalidated when the config mtime changes.
+
+    Returns None when the config file does not exist; callers fall back to
+    treating the pattern as a direct host. One stat covers the existence
+    check instead of a separate isfile() probe before every open.
+    """
+    try:
+        mtime_ns = os.stat(SSH_CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    try:
+        with open(CONFIG_CACHE_FILE, "rb") as f:
+            cached_mtime_ns, sorted_hosts, hostnames = pickle.load(f)
+        if cached_mtime_ns == mtime_ns:
+            return sorted_hosts, hostnames
+    except (OSError, pickle.PickleError, EOFError, ValueError):
+        pass
+    sorted_hosts, hostnames = parse_ssh_config()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(CONFIG_CACHE_FILE, "wb") as f:
+            pickle.dump((mtime_ns, sorted_hosts, hostnames), f)
+    except OSError:
+        pass
+    return sorted_hosts, hostnames
+
+def extract_hosts(ctx: SSHContext) -> SSHContext:
+    """Resolve ctx.pattern against the ssh config; returns the context with username and hosts filled in."""
+    username = ""
+    host_pattern = ctx.pattern
     if "@" in host_pattern:
-        USERNAME, host_pattern = host_pattern.split("@", 1)
-        log("DEBUG", f"Extracted username: {USERNAME}, host pattern: {host_pattern}")
+        username, host_pattern = host_pattern.split("@", 1)
+        logger.debug("Extracted username: %s, host pattern: %s", username, host_pattern)
     else:
-        USERNAME = ""
-        log("DEBUG", f"Host pattern: {host_pattern}")
-
-    HOSTS = []
-    if os.path.isfile(SSH_CONFIG_FILE):
-        with open(SSH_CONFIG_FILE, "r") as f:
-            lines = f.readlines()
-            current_host = ""
-            hostnames = {}
-            hosts_set = set()
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if line.startswith("Host "):
-                    parts = line.split()
-                    for h in parts[1:]:
-                        if "*" not in h:
-                            current_host = h
-                            hosts_set.add(h)
-                elif line.startswith("Hostname "):
-                    if current_host:
-                        hostnames[current_host] = line.split()[1]
-            printed = set()
-            for host in sorted(hosts_set, key=lambda x: x.split(".")):
-                if host_pattern.lower() in host.lower() and "*" not in host:
-                    hostname = hostnames.get(host, host)
-                    if hostname not in printed:
-                        HOSTS.append(hostname)
-                        printed.add(hostname)
-
-    host_count = len(HOSTS)
-    if host_count > 1 and not MASS_MODE:
+        logger.debug("Host pattern: %s", host_pattern)
+
+    hosts = []
+    config = load_ssh_config()
+    if config is None:
+        logger.warning("SSH config file not found. Proceeding without it.")
+    else:
+        sorted_hosts, hostnames = config
+        pat_cf = host_pattern.casefold()
+        printed = set()
+        for host_cf, host in sorted_hosts:
+            if pat_cf in host_cf:
+                hostname = hostnames.get(host, host)
+                if hostname not in printed:
+                    hosts.append(hostname)
+                    printed.add(hostname)
+
+    if len(hosts) > 1 and not ctx.mass_mode:
         print("Multiple hosts detected:")
-        for host in HOSTS:
+        for host in hosts:
             print(f"- {host}")
         print("Use --mass flag to execute commands on multiple hosts.")
         sys.exit(1)
-    if not HOSTS:
-        log("WARN", f"No hosts found matching '{host_pattern}'. Falling back to direct connection.")
-        HOSTS = [host_pattern]
-    log("DEBUG", f"Matching hosts: {', '.join(HOSTS)}")
+    if not hosts:
+        logger.warning("No hosts found matching '%s'. Falling back to direct connection.", host_pattern)
+        hosts = [host_pattern]
+    logger.debug("Matching hosts: %s", ", ".join(hosts))
+    return replace(ctx, username=username, hosts=tuple(hosts))
 
 # Process Substitution Handling
+_PS_RE = re.compile(r"<\(([^()]*)\)")
+_PS_PROCS: List[subprocess.Popen] = []
+_PS_FIFOS: List[str] = []
+_PS_COUNTER = itertools.count()
+
+def _cleanup_fifos():
+    for fifo_path in _PS_FIFOS:
+        try:
+            os.unlink(fifo_path)
+        except OSError:
+            pass
+    _PS_FIFOS.clear()
+
+atexit.register(_cleanup_fifos)
+
 def handle_process_substitution(cmd: str) -> str:
     """
-    Handle Bash-style process substitution <(command) by creating a temporary FIFO or file descriptor.
-    Inspired by search results on process substitution in Python.
+    Handle Bash-style process substitution <(command) by pointing the command
+    at a named pipe that the child process writes into directly.
     """
+    if "<(" not in cmd:
+        return cmd
+
     def create_subprocess(cmd_part: str) -> str:
-        fifo_path = os.path.join(tempfile.gettempdir(), f"xssh_fifo_{os.getpid()}_{id(cmd_part)}")
+        fifo_path = os.path.join(tempfile.gettempdir(), f"xssh_fifo_{os.getpid()}_{next(_PS_COUNTER)}")
         os.mkfifo(fifo_path)
-        def write_to_fifo():
-            with open(fifo_path, "w") as f:
-                result = subprocess.run(cmd_part, shell=True, text=True, capture_output=True)
-                f.write(result.stdout)
-        threading.Thread(target=write_to_fifo, daemon=True).start()
+
+        def spawn_for_reader():
+            # Block-opening the write end is the FIFO rendezvous: it returns
+            # once a reader attaches, and only then is the child started,
+            # writing straight into the pipe with no Python-side buffering.
+            fifo_fd = os.open(fifo_path, os.O_WRONLY)
+            # argv form: no /bin/sh fork to re-parse the command, no quoting
+            # surprises from shell interpretation.
+            proc = subprocess.Popen(shlex.split(cmd_part), stdout=fifo_fd, close_fds=True)
+            os.close(fifo_fd)
+            _PS_PROCS.append(proc)
+
+        # Daemon so a substitution nobody ever reads cannot block exit.
+        threading.Thread(target=spawn_for_reader, daemon=True).start()
+        _PS_FIFOS.append(fifo_path)
         return fifo_path
 
-    pattern = r"<(\([^()]*\))"
-    matches = re.findall(pattern, cmd)
-    for match in matches:
-        fifo_path = create_subprocess(match)
-        cmd = cmd.replace(f"<({match})", fifo_path)
-    return cmd
+    return _PS_RE.sub(lambda m: create_subprocess(m.group(1)), cmd)
+
+def wait_for_substitutions():
+    # Best-effort reap only: a child still blocked writing to a pipe whose
+    # reader has gone away must not hang script exit, so stragglers are
+    # terminated rather than waited on.
+    for proc in _PS_PROCS:
+        if proc.poll() is None:
+            proc.terminate()
+        proc.wait()
+    _PS_PROCS.clear()
 
 # Remote Command Wrapping
-def wrap_remote_command() -> str:
-    if not COMMAND:
+def wrap_remote_command(ctx: SSHContext) -> str:
+    if not ctx.command:
         return ""
-    cmd_str = " ".join(COMMAND)
+    cmd_str = " ".join(ctx.command)
     cmd_str = handle_process_substitution(cmd_str)  # Handle process substitution
-    if len(COMMAND) == 1:
-        if SUDO_MODE:
+    if len(ctx.command) == 1:
+        if ctx.sudo_mode:
             return f"sudo {cmd_str}"
         return cmd_str
-    if any(char in cmd_str for char in "&|;><$(){}[]*") or len(COMMAND) > 1:
-        quoted_cmd = " ".join(f"'{c}'" for c in COMMAND)
-        if SUDO_MODE:
+    if any(char in cmd_str for char in "&|;><$(){}[]*") or len(ctx.command) > 1:
+        quoted_cmd = " ".join(f"'{c}'" for c in ctx.command)
+        if ctx.sudo_mode:
             return f"sudo sh -c {quoted_cmd}"
         return f"sh -c {quoted_cmd}"
-    if SUDO_MODE:
+    if ctx.sudo_mode:
         return f"sudo {cmd_str}"
     return cmd_str
 
 # SSH Execution with Paramiko
-def execute_ssh(host: str, output_file: str, verbose_prefix: str) -> int:
-    exit_code = 0
-    if VERBOSE_MODE and verbose_prefix:
-        with open(output_file, "w") as f:
-            f.write(f"{verbose_prefix}\n")
+# Connection pool: one authenticated client per host, reused across commands
+# so only the first operation per host pays for key exchange and auth.
+_SSH_POOL: Dict[str, paramiko.SSHClient] = {}
+_SSH_POOL_LOCK = threading.Lock()
 
+def get_ssh_client(host: str, ctx: SSHContext) -> paramiko.SSHClient:
+    with _SSH_POOL_LOCK:
+        ssh = _SSH_POOL.get(host)
+        if ssh is not None:
+            transport = ssh.get_transport()
+            if transport is not None and transport.is_active():
+                return ssh
+            _SSH_POOL.pop(host, None)
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    connect_kwargs = {"hostname": host, "timeout": 5}
+    if ctx.username:
+        connect_kwargs["username"] = ctx.username
+    # Allow agent and look for keys in default locations
+    connect_kwargs["allow_agent"] = True
+    connect_kwargs["look_for_keys"] = True
+    ssh.connect(**connect_kwargs)
+    with _SSH_POOL_LOCK:
+        _SSH_POOL[host] = ssh
+    return ssh
+
+def execute_ssh(host: str, ctx: SSHContext, remote_cmd: str, sink=None) -> Tuple[int, str]:
+    # sink: optional callable receiving decoded output chunks as they arrive;
+    # when None, chunks are accumulated and returned as one string.
+    exit_code = 0
+    output_parts = []
+    emit = sink if sink is not None else output_parts.append
     try:
-        connect_kwargs = {"hostname": host, "timeout": 5}
-        if USERNAME:
-            connect_kwargs["username"] = USERNAME
-        # Workaround for "No authentication methods available" error
-        # Attempt to use a dummy key if no other auth method is specified
-        connect_kwargs["pkey"] = paramiko.ecdsakey.ECDSAKey.generate()
-        # Allow agent and look for keys in default locations
-        connect_kwargs["allow_agent"] = True
-        connect_kwargs["look_for_keys"] = True
-        ssh.connect(**connect_kwargs)
-        remote_cmd = wrap_remote_command()
+        ssh = get_ssh_client(host, ctx)
         if remote_cmd:
-            log("DEBUG", f"Executing command on {host}: {remote_cmd}")
-            if SUDO_MODE:
-                stdin, stdout, stderr = ssh.exec_command(remote_cmd, get_pty=True)
-            else:
-                stdin, stdout, stderr = ssh.exec_command(remote_cmd)
-            output = stdout.read().decode() + stderr.read().decode()
-            with open(output_file, "a") as f:
-                f.write(output)
-            exit_status = stdout.channel.recv_exit_status()
+            logger.debug("Executing command on %s: %s", host, remote_cmd)
+            channel = ssh.get_transport().open_session()
+            if ctx.sudo_mode:
+                channel.get_pty()
+            channel.set_combine_stderr(True)
+            channel.exec_command(remote_cmd)
+            # Read in fixed-size chunks so memory stays constant regardless
+            # of how much the remote command prints. The incremental decoder
+            # carries multibyte sequences split across chunk boundaries.
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")
+            while True:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                chunk = decoder.decode(data)
+                if chunk:
+                    emit(chunk)
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                emit(tail)
+            exit_status = channel.recv_exit_status()
             if exit_status != 0:
                 exit_code = exit_status
-                log("ERROR", f"Command failed on {host} with exit code {exit_code}")
-            elif "error" in output.lower() or "not found" in output.lower():
-                exit_code = 127
-                log("ERROR", f"Command failed on {host} due to error in output (exit code set to {exit_code})")
+                logger.error("Command failed on %s with exit code %s", host, exit_code)
         else:
-            log("DEBUG", f"Opening interactive session on {host}")
-            log("WARN", "Interactive sessions are not supported in this Python version.")
+            logger.debug("Opening interactive session on %s", host)
+            logger.warning("Interactive sessions are not supported in this Python version.")
             exit_code = 1
+    except paramiko.ssh_exception.AuthenticationException as e:
+        exit_code = 1
+        logger.error("Authentication failed on %s: %s (no agent identity or usable key file found)", host, e)
+        emit(f"Authentication failed on {host}: {str(e)}\n")
+    except paramiko.ssh_exception.NoValidConnectionsError as e:
+        exit_code = 1
+        logger.error("Unable to reach %s: %s", host, e)
+        emit(f"Unable to reach {host}: {str(e)}\n")
     except Exception as e:
         exit_code = 1
-        log("ERROR", f"SSH connection failed on {host}: {str(e)}")
-        with open(output_file, "a") as f:
-            f.write(f"Connection failed on {host}: {str(e)}\n")
-    finally:
-        ssh.close()
+        logger.error("SSH connection failed on %s: %s", host, e)
+        emit(f"Connection failed on {host}: {str(e)}\n")
     if exit_code == 0:
-        log_debug("Command executed successfully", host)
-    return exit_code
+        logger.debug("Command executed successfully on %s", host)
+    return exit_code, "".join(output_parts)
 
 
-def execute_ssh_command():
-    for host in HOSTS:
-        if VERBOSE_MODE:
+def execute_ssh_command(ctx: SSHContext, remote_cmd: str):
+    for host in ctx.hosts:
+        if ctx.verbose_mode:
             print(f"Executing command on {host}:")
-        execute_ssh(host, "/dev/stdout", "")
-        log("DEBUG", "All commands attempted.")
-
-def parallel_execute():
-    if MASS_MODE:
-        tmpdir = tempfile.mkdtemp()
-        threads = []
-        for host in HOSTS:
-            tmpfile = os.path.join(tmpdir, f"{host}.out")
-            prefix = f"--- {host} ---" if VERBOSE_MODE else ""
-            thread = threading.Thread(target=execute_ssh, args=(host, tmpfile, prefix))
-            thread.start()
-            threads.append(thread)
-        for thread in threads:
-            thread.join()
-        for file in os.listdir(tmpdir):
-            with open(os.path.join(tmpdir, file), "r") as f:
-                print(f.read())
-        os.rmdir(tmpdir)
+        execute_ssh(host, ctx, remote_cmd, sink=sys.stdout.write)
+        logger.debug("All commands attempted.")
+
+def parallel_execute_pssh(ctx: SSHContext, remote_cmd: str):
+    client = ParallelSSHClient(
+        list(ctx.hosts),
+        user=ctx.username or None,
+        pool_size=min(len(ctx.hosts), ctx.jobs),
+        allow_agent=True,
+    )
+    # stop_on_errors=False: an unreachable or auth-failing host is reported
+    # per host, like the paramiko path, instead of aborting the whole fanout.
+    # sudo stays False: wrap_remote_command already prefixed sudo when
+    # ctx.sudo_mode, and pssh's own wrapping would apply it a second time.
+    host_outputs = client.run_command(
+        remote_cmd, use_pty=ctx.sudo_mode, stop_on_errors=False
+    )
+    client.join()
+    for host_output in host_outputs:
+        if host_output.exception is not None:
+            logger.error("SSH connection failed on %s: %s", host_output.host, host_output.exception)
+            print(f"Connection failed on {host_output.host}: {host_output.exception}")
+            continue
+        if ctx.verbose_mode:
+            print(f"--- {host_output.host} ---")
+        for line in host_output.stdout:
+            print(line)
+        # The paramiko paths combine stderr into the stream; print it here
+        # too so error text is not silently dropped.
+        for line in host_output.stderr:
+            print(line)
+        if host_output.exit_code not in (0, None):
+            logger.error("Command failed on %s with exit code %s", host_output.host, host_output.exit_code)
+
+def _open_mass_channels(ctx: SSHContext, remote_cmd: str, out_fd: int) -> Dict[paramiko.Channel, str]:
+    # Connects block, so dial hosts from a bounded thread pool; the channels
+    # all land in this process for the single-threaded fan-in below.
+    channels = {}
+    with ThreadPoolExecutor(max_workers=min(len(ctx.hosts), ctx.jobs)) as executor:
+        futures = {executor.submit(get_ssh_client, host, ctx): host for host in ctx.hosts}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                ssh = future.result()
+            except paramiko.ssh_exception.AuthenticationException as e:
+                logger.error("Authentication failed on %s: %s (no agent identity or usable key file found)", host, e)
+                os.write(out_fd, f"Authentication failed on {host}: {e}\n".encode())
+                continue
+            except paramiko.ssh_exception.NoValidConnectionsError as e:
+                logger.error("Unable to reach %s: %s", host, e)
+                os.write(out_fd, f"Unable to reach {host}: {e}\n".encode())
+                continue
+            except Exception as e:
+                logger.error("SSH connection failed on %s: %s", host, e)
+                os.write(out_fd, f"Connection failed on {host}: {e}\n".encode())
+                continue
+            channel = ssh.get_transport().open_session()
+            if ctx.sudo_mode:
+                channel.get_pty()
+            channel.set_combine_stderr(True)
+            channel.exec_command(remote_cmd)
+            channels[channel] = host
+    return channels
+
+def parallel_execute(ctx: SSHContext, remote_cmd: str):
+    if ctx.mass_mode:
+        if ParallelSSHClient is not None:
+            parallel_execute_pssh(ctx, remote_cmd)
+            return
+        sys.stdout.flush()
+        out_fd = sys.stdout.fileno()
+        channels = _open_mass_channels(ctx, remote_cmd, out_fd)
+        # Fan-in: one epoll loop over all channels instead of one blocking
+        # worker per host, so completions are acted on as they happen.
+        selector = selectors.DefaultSelector()
+        for channel, host in channels.items():
+            channel.setblocking(False)
+            selector.register(channel, selectors.EVENT_READ, host)
+        while channels:
+            for key, _ in selector.select():
+                channel, host = key.fileobj, key.data
+                try:
+                    data = channel.recv(65536)
+                except TimeoutError:
+                    continue
+                if data:
+                    if ctx.verbose_mode:
+                        os.writev(out_fd, [f"--- {host} ---\n".encode(), data])
+                    else:
+                        os.write(out_fd, data)
+                    continue
+                # EOF: collect the exit status and drop the channel.
+                exit_status = channel.recv_exit_status()
+                if exit_status != 0:
+                    logger.error("Command failed on %s with exit code %s", host, exit_status)
+                selector.unregister(channel)
+                channel.close()
+                del channels[channel]
+        selector.close()
 
 # Main Execution
-if __name__ == "__main__":
+def main():
     args = parse_arguments()
     if args.pattern in ["-h", "--help"]:
         usage()
         sys.exit(0)
-    validate_input(args)
-    setup_logging()
-    validate_prerequisites()
-    extract_hosts()
-    if MASS_MODE:
-        parallel_execute()
+    ctx = validate_input(args)
+    setup_logging(ctx.debug_mode, ctx.log_file)
+    ctx = extract_hosts(ctx)
+    # Wrap (and run any process substitutions) exactly once; every host
+    # shares the same remote command and FIFOs.
+    remote_cmd = wrap_remote_command(ctx)
+    if ctx.mass_mode:
+        parallel_execute(ctx, remote_cmd)
     else:
-        execute_ssh_command()
+        execute_ssh_command(ctx, remote_cmd)
+    wait_for_substitutions()
+
+if __name__ == "__main__":
+    main()